@@ -1,11 +1,26 @@
-from typing import Any, List
-from lark import Transformer, Tree, Token
+from functools import lru_cache
+from typing import Any, Iterable, Iterator, List, Optional
+from lark import Tree, Token, v_args
+from lark.visitors import Transformer_InPlace
+from multiprocessing import Pool
+from sys import intern
+import os
 import re
 import json
 
+from .parser import get_parser
+
+try:
+    import orjson
+except ImportError:  # optional, see the "fast" extra
+    orjson = None  # type: ignore
+
 # For extracting syscall names inside "<... clone resumed>"
 _RESUMED_RE = re.compile(r"<\.\.\.\s+([a-zA-Z0-9_]+)\s+resumed>")
+_match_resumed = _RESUMED_RE.match
 
+# Paths and string arguments repeat heavily across a trace
+@lru_cache(maxsize=65536)
 def _decode_c_string(s: str) -> str:
         """
         Convert a raw strace string token (which may or may not include surrounding quotes)
@@ -25,60 +40,66 @@ def _decode_c_string(s: str) -> str:
         if len(s) >= 2 and s[0] == '"' and s[-1] == '"':
             s = s[1:-1]  # strip the quotes
 
+        # Nothing to unescape, skip the latin1 round trip
+        if "\\" not in s:
+            return s
+
+        return _unescape_c_string(s, original)
+
+def _decode_arg(arg):
+        """
+        C_EXPR/PLAIN_ARG terminals reach their parent rule as bare tokens;
+        decode them there. Anything else is already transformed.
+        """
+        if type(arg) is not Token or (arg.type != "C_EXPR" and arg.type != "PLAIN_ARG"):
+            return arg
+        value = arg.value
+        # Integers, NULL, ORed flags: not quoted and nothing to unescape
+        if "\\" not in value and value[:1] != '"':
+            return value
+        return _decode_c_string(value)
+
+def _unescape_c_string(s: str, original: str) -> str:
         try:
             return s.encode("latin1").decode("unicode_escape")
         except Exception:
             # Fallback: return original
             return original
 
-def convert(cls):
-    def f(self, children):
-        return cls(children[0])
-    return f
-
-def first_child():
-    def f(self, children):
-        return children[0]
-    return f
 
-
-class JsonTransformer(Transformer):
+@v_args(inline=True)
+class JsonTransformer(Transformer_InPlace):
 
     # -------------------------------------
     # Top-level
     # -------------------------------------
 
-    def start(self, children):
-        return children
+    def start(self, *lines):
+        return list(lines)
 
-    def line(self, children):
+    def line_pid(self, pid, ts, body):
         """
-        Line can be:
+        Line with a pid prefix (strace -f):
             pid timestamp body
-            timestamp body
-        Body must ALWAYS become a dict.
+        Every body alternative is transformed into a dict.
         """
-        if len(children) == 3:
-            pid, ts, body = children
-        else:
-            pid = None
-            ts, body = children
-
-        # Ensure body is dict
-        if not isinstance(body, dict):
-            raise TypeError(f"Body transformer did not return dict: {body}")
-
-        body["timestamp"] = ts
-        if pid is not None:
-            body["pid"] = pid
+        body["timestamp"] = float(ts.value)
+        body["pid"] = pid
+        return body
 
+    def line_nopid(self, ts, body):
+        """
+        Line without a pid prefix:
+            timestamp body
+        """
+        body["timestamp"] = float(ts.value)
         return body
 
     # -------------------------------------
     # Syscall core
     # -------------------------------------
 
-    def syscall(self, children):
+    def syscall(self, *children):
         """
         syscall_name "(" args? ")" "=" result [duration]
         children can be:
@@ -87,7 +108,9 @@ class JsonTransformer(Transformer):
           [name, args, result, duration]
           [name, result, duration]
         """
-        name = children[0]
+        # syscall_name and syscall_result are inlined: NAME token, then
+        # a SYSCALL_RESULT token or an fd_with_path dict
+        name = intern(children[0].value)
 
         # Case: second element is args (list)
         if len(children) >= 2 and isinstance(children[1], list):
@@ -98,6 +121,11 @@ class JsonTransformer(Transformer):
             args = []
             result = children[1] if len(children) > 1 else None
 
+        if isinstance(result, Token):
+            result = _decode_c_string(result.value)
+        elif result is not None:
+            result = _decode_c_string(str(result))
+
         return {
             "type": "syscall",
             "status": "finished",
@@ -106,59 +134,49 @@ class JsonTransformer(Transformer):
             "result": result,
         }
 
-    def syscall_name(self, children):
-        return str(children[0])
-
-    def syscall_args(self, children):
-        return children
-
-    def syscall_result(self, children):
-        return _decode_c_string(str(children[0]))
+    def syscall_args(self, *args):
+        return [_decode_arg(a) for a in args]
 
     # -------------------------------------
     # Unfinished call
     # -------------------------------------
 
-    def unfinished_line(self, children):
-        # children: [unfinished_syscall, "<unfinished ...>"]
-        call = children[0]
-        status = str(children[1])
-
+    def unfinished_line(self, call, status):
+        # status is the "<unfinished ...>" token
+        name, args = call
         return {
             "type": "syscall",
             "status": "unfinished",
-            "name": call["name"],
-            "args": call["args"],
+            "name": name,
+            "args": args,
             "result": None,
         }
 
-    def unfinished_syscall(self, children):
+    def unfinished_syscall(self, name, *args):
         """
-        children = [name] or [name, args]
+        children = [name, arg, arg, ...] (syscall args are inlined)
+        Only consumed by unfinished_line, so a (name, args) tuple is enough.
         """
-        name = children[0]
-        args = children[1] if len(children) > 1 else []
-        return {
-            "name": name,
-            "args": args,
-        }
+        return intern(name.value), [_decode_arg(a) for a in args]
 
     # -------------------------------------
     # Resumed call
     # -------------------------------------
 
-    def resumed_line(self, children):
+    def resumed_line(self, tag, tail=None):
         """
         resumed_line : RESUMED_TAG _SP? resumed_tail
         resumed_tail: args?) "=" result (duration)?
         BUT strace often prints:
           <... rt_sigprocmask resumed>NULL, 8) = 0
         """
-        tag = str(children[0])
-        m = _RESUMED_RE.match(tag)
-        name = m.group(1) if m else None
-
-        tail = children[1] if len(children) > 1 else []
+        tag = tag.value
+        if tag.startswith("<... ") and tag.endswith(" resumed>"):
+            # Common shape, slice the name out without the regex engine
+            name = intern(tag[5:-9].strip())
+        else:
+            m = _match_resumed(tag)
+            name = intern(m.group(1)) if m else None
 
         # Parse tail into args/result
         args = []
@@ -185,12 +203,10 @@ class JsonTransformer(Transformer):
     # Signal line
     # -------------------------------------
 
-    def signal_line(self, children):
-        sig = str(children[0])
-        info = children[1]
+    def signal_line(self, sig, info):
         return {
             "type": "signal",
-            "name": sig,
+            "name": intern(sig.value),
             "status": "signal",
             "info": info,
         }
@@ -199,60 +215,58 @@ class JsonTransformer(Transformer):
     # Alert line
     # -------------------------------------
 
-    def alert_body(self, children):
+    def alert_body(self, *children):
         return {
             "type": "alert",
             "status": "alert",
-            "result": " ".join(str(c) for c in children),
+            "result": " ".join([c.value for c in children]),
         }
 
     # -------------------------------------
     # Struct / argument types
     # -------------------------------------
 
-    def braced(self, children):
-        fields = children[0]
-        result = {}
+    def braced(self, *fields):
+        items = []
         truncated = False
 
         for f in fields:
             if f == "...":
                 truncated = True
                 continue
-            if isinstance(f, dict) and f.get("type") == "key_value":
-                result[f["key"]] = f["value"]
+            if type(f) is dict and f.get("type") == "key_value":
+                items.append((f["key"], f["value"]))
             else:
                 # Unexpected field type; keep raw
-                result[str(f)] = f
+                items.append((str(f), f))
 
         return {
             "type": "struct",
-            "fields": result,
+            "fields": dict(items),
             "truncated": truncated
         }
 
-    def bracketed(self, children):
-        items = children[0]
+    def bracketed(self, *items):
         return {
             "type": "list",
-            "items": items
+            "items": [_decode_arg(i) for i in items]
         }
 
     # -------------------------------------
     # Expression Chaining
     # -------------------------------------
-    def field_expr(self, children):
+    def field_expr(self, *children):
         """
         Handles chains like: WIFEXITED(s) && WEXITSTATUS(s) == 1
         If it's a single item, return it as-is.
         If it's a chain, reconstruct it into a single string for readability.
         """
         if len(children) == 1:
-            return children[0]
+            return _decode_arg(children[0])
 
         # Helper to convert parsed objects back to string representation
         parts = []
-        for child in children:
+        for child in map(_decode_arg, children):
             if isinstance(child, dict) and child.get("type") == "function":
                 # Reconstruct function call: name(args)
                 # args might be a list or a single string depending on your other rules
@@ -265,87 +279,133 @@ class JsonTransformer(Transformer):
                     arg_str = str(args)
                 parts.append(f"{child['name']}({arg_str})")
             elif isinstance(child, Token):
-                parts.append(str(child))
+                parts.append(child.value)
             else:
                 parts.append(str(child))
         
         # Return the reconstructed expression string
         return " ".join(parts)
 
-    def struct_fields(self, children):
-        return children
-
-    def kv(self, children):
-        key, value = children
+    def kv(self, key, value):
         return {
             "type": "key_value",
-            "key": str(key),
-            "value": value,
+            "key": intern(key.value),
+            "value": _decode_arg(value),
         }
 
-    def function_like(self, children):
-        name, args = children
+    def function_like(self, name, *args):
         return {
             "type": "function",
-            "name": str(name),
-            "args": args,
+            "name": intern(name.value),
+            "args": [_decode_arg(a) for a in args],
         }
     
-    def fd_with_path(self, children):
+    def fd_with_path(self, fd, raw):
         """
         fd_with_path: DIGIT/NAME "<" RAWPATH ">"
         children => [fd, raw_path_token]
         """
-        fd = str(children[0])
-        raw = str(children[1])
-
         return {
             "type": "fd",
-            "fd": fd,
-            "path": _decode_c_string(raw),
+            "fd": fd.value,
+            "path": _decode_c_string(raw.value),
         }
 
-    def sigset(self, children):
+    def sigset(self, *children):
+        # NEGATED can only be the first child: NEGATED? "[" SIGNAL* "]"
         neg = False
-        args = []
-        for ch in children:
-            if isinstance(ch, Token) and ch.type == "NEGATED":
-                neg = True
-            else:
-                args.append(str(ch))
+        start = 0
+        if children and type(children[0]) is Token and children[0].type == "NEGATED":
+            neg = True
+            start = 1
+        args = [ch.value for ch in children[start:]]
         return {
             "type": "sigset",
             "negated": neg,
             "args": args,
         }
     
-    def len_arrow(self, children):
+    def len_arrow(self, src, dst):
         """
         [LEN => LEN]  (e.g. [28 => 16])
         """
-        # children = [Token('DIGIT', '28'), Token('DIGIT', '16')]
+        # src, dst = Token('DIGIT', '28'), Token('DIGIT', '16')
         return {
             "type": "len",
-            "from": int(str(children[0])),
-            "to": int(str(children[1])),
+            "from": int(src.value),
+            "to": int(dst.value),
         }
 
-    def c_expr(self, children):
-        return _decode_c_string(str(children[0]))
-
-    def plain_arg(self, children):
-        return _decode_c_string(str(children[0]))
-
     # -------------------------------------
     # Misc
     # -------------------------------------
 
-    body = first_child()
-    timestamp = convert(float)
+    def pid(self, pid):
+        return int(pid.value)
+
 
-    def pid(self, children):
-        return int(str(children[0]))
+# JsonTransformer keeps no per-tree state, so one instance serves every call.
+_TRANSFORMER = JsonTransformer()
 
 
 def to_json(tree: Tree) -> Any:
-    return JsonTransformer().transform(tree)
+    return _TRANSFORMER.transform(tree)
+
+
+def to_json_bytes(tree: Tree) -> bytes:
+    """
+    Transform the tree and serialize it to compact UTF-8 JSON.
+
+    Uses orjson when it is installed, otherwise the stdlib json module
+    with matching output settings.
+    """
+    result = _TRANSFORMER.transform(tree)
+    if orjson is not None:
+        return orjson.dumps(result)
+    text = json.dumps(result, ensure_ascii=False, separators=(",", ":"))
+    return text.encode("utf-8")
+
+
+def iter_to_json(lines: Iterable[str]) -> Iterator[Any]:
+    """
+    Parse and transform strace output lazily, one line at a time.
+
+    Only the current line's tree is held in memory, so this works on
+    traces of any size. Pass a file opened with a large buffer, e.g.
+    open(path, buffering=1 << 20). Trailing newlines are optional; blank
+    lines are skipped.
+    """
+    parser = get_parser()
+    for line in lines:
+        line = line.rstrip("\n")
+        if not line:
+            continue
+        yield from _TRANSFORMER.transform(parser.parse(line + "\n"))
+
+
+def _lines_to_json(lines: List[str]) -> List[Any]:
+    return list(iter_to_json(lines))
+
+
+def to_json_lines(lines: Iterable[str], workers: Optional[int] = None) -> List[Any]:
+    """
+    Parse and transform strace output lines, spread over a process pool.
+
+    Lines are independent, so they are parsed in chunks by `workers`
+    processes (default: os.cpu_count()) and the results concatenated in
+    input order. Trailing newlines are optional; blank lines are skipped.
+    """
+    lines = [line.rstrip("\n") + "\n" for line in lines if line.rstrip("\n")]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(lines) < 2:
+        return _lines_to_json(lines)
+
+    # A few chunks per worker keeps them busy without paying IPC per line
+    size = -(-len(lines) // (workers * 4))
+    chunks = [lines[i:i + size] for i in range(0, len(lines), size)]
+    with Pool(workers) as pool:
+        result = []
+        for chunk in pool.map(_lines_to_json, chunks):
+            result.extend(chunk)
+    return result
@@ -1,9 +1,16 @@
+import json
 from importlib.resources import read_text
 
 import pytest
 from lark import Token, Tree
 
-from strace_parser.json_transformer import to_json
+from strace_parser import json_transformer
+from strace_parser.json_transformer import (
+    iter_to_json,
+    to_json,
+    to_json_bytes,
+    to_json_lines,
+)
 from strace_parser.parser import get_parser
 
 from . import data
@@ -72,3 +79,28 @@ def test_json_transformer():
         "name": "connect",
         "result": "-123 ENOENT (No such file or directory) <0.000001>",
     } == line, f"Did not match {tree.pretty()}"
+
+
+def test_to_json_lines_matches_to_json():
+    lines = read_text(data, "samples.txt").splitlines()[:20]
+    expected = [to_json(get_parser().parse(line + "\n"))[0] for line in lines]
+    assert to_json_lines(lines, workers=1) == expected
+    assert to_json_lines(lines, workers=2) == expected
+
+
+def test_iter_to_json_matches_to_json():
+    lines = read_text(data, "samples.txt").splitlines()[:20]
+    expected = [to_json(get_parser().parse(line + "\n"))[0] for line in lines]
+    assert list(iter_to_json(line + "\n" for line in lines)) == expected
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_to_json_bytes(monkeypatch, use_orjson):
+    if use_orjson:
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(json_transformer, "orjson", None)
+    for line in read_text(data, "samples.txt").splitlines()[:20]:
+        expected = to_json(get_parser().parse(line + "\n"))
+        result = to_json_bytes(get_parser().parse(line + "\n"))
+        assert json.loads(result) == expected